@@ -1,9 +1,9 @@
 # Imports
 import pandas as pd
-import numpy as np
 from decouple import config
 import plotly.graph_objects as go
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 pd.options.mode.chained_assignment = None  # default='warn'
 
@@ -17,25 +17,27 @@ def connect_to_gsheets() -> pd.DataFrame:
     sheet_name = "Applications"
     sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={sheet_name}"
 
-    if pd.read_csv(sheet_url).empty:
+    # Only parse the columns used for the sankey diagram
+    applications_raw = pd.read_csv(sheet_url, usecols=lambda column: column == 'Source' or column.startswith('Status'), dtype=str)
+
+    if applications_raw.empty:
         raise ValueError("No data found in Google Sheets")
-    
-    applications_raw = pd.read_csv(sheet_url)
 
     return applications_raw
 
 def clean_data(applications_raw) -> pd.DataFrame:
     """Basic cleaning of data
-    - Drop columns with all NaN values
-    - Drop columns that are not needed
     - Drop rows with all NaN values
+    - Convert source and status columns to categorical
+
+    Columns that are not needed are already skipped when reading the CSV
 
     Returns: cleaned DataFrame
     """
 
-    applications = applications_raw.dropna(how='all', axis=1)
-    applications.drop(columns=['S/N', 'Company', 'Position', 'Date Applied', 'Link'], inplace=True)
-    applications.dropna(how='all', axis=0, inplace=True)
+    applications = applications_raw.dropna(how='all', axis=0)
+    for column in applications.columns:
+        applications[column] = applications[column].astype('category')
 
     return applications
 
@@ -45,6 +47,7 @@ def get_unique_values(applications) -> dict:
     - statuses: unique statuses
     - intermediate_statuses: unique statuses excluding 'Rejected', 'DNF', 'Offered', 'Accepted'
     - unique_nodes: unique nodes for the sankey diagram
+    - node_codes: unique number of each node, in the order of unique_nodes
     - node_value_counts: counts of each node
     - unique_nodes_with_values: unique nodes with their counts
 
@@ -55,107 +58,85 @@ def get_unique_values(applications) -> dict:
     job_sources = applications['Source'].unique().tolist()
 
     status_stages = [stage for stage in applications.columns if stage.startswith('Status')]
-    for i in range(len(status_stages)):
-        if i == 0:
-            statuses = applications[status_stages[i]].unique().tolist()
-        else:
-            statuses.extend(applications[status_stages[i]].unique().tolist())
-    statuses = list(set(statuses))
-    statuses.remove(np.nan)
-
-    intermediate_statuses = statuses.copy()
-    to_remove = ['Rejected after Applying', 'Rejected after Interview', 'Rejected', 'DNF', 'Offered', 'Accepted', 'Declined']
-    for item in to_remove:
-        if item in intermediate_statuses:
-            intermediate_statuses.remove(item)
+    status_counts = applications[status_stages].stack().value_counts(sort=False) # NaN is dropped when stacking
+    statuses = status_counts.index.tolist()
+
+    to_remove = frozenset({'Rejected after Applying', 'Rejected after Interview', 'Rejected', 'DNF', 'Offered', 'Accepted', 'Declined'})
+    intermediate_statuses = frozenset(status for status in statuses if status not in to_remove)
 
     unique_nodes = ['Applications', 'No reply']
     unique_nodes += job_sources + statuses
+    node_codes = {node: code for code, node in enumerate(unique_nodes)}
 
     node_value_counts = {node: 0 for node in unique_nodes}
     job_sources_count = applications['Source'].value_counts().to_dict()
     for source in job_sources_count:
         node_value_counts[source] += job_sources_count[source]
-    for stage in status_stages: 
-        status_count = applications[stage].value_counts().to_dict()
-        for status in status_count:
-            node_value_counts[status] += status_count[status]
+    for status, count in status_counts.items():
+        node_value_counts[status] += count
     node_value_counts['Applications'] = len(applications)
-    node_value_counts['No reply'] = len(applications[applications['Status 1'].isna() & applications['Status 2'].isna()])
+    node_value_counts['No reply'] = int(applications[status_stages].isna().to_numpy().all(axis=1).sum())
 
-    unique_nodes_with_values = [node + ': ' + str(node_value_counts[node]) for node in node_value_counts]
+    node_value_counts_series = pd.Series(node_value_counts)
+    unique_nodes_with_values = (node_value_counts_series.index.astype(str) + ': ' + node_value_counts_series.astype(str)).tolist()
 
     unique_values_dict = {
         'job_sources': job_sources,
         'statuses': statuses,
         'intermediate_statuses': intermediate_statuses,
         'unique_nodes': unique_nodes,
+        'node_codes': node_codes,
         'node_value_counts': node_value_counts,
         'unique_nodes_with_values': unique_nodes_with_values
     }
 
     return unique_values_dict, status_stages
 
-def generate_sankey_df(applications, status_stages) -> pd.DataFrame:
-    """Generate DataFrame for plotly to plot a Sankey Diagram
-    The dataframe requires 3 columns: source, target, value
+def generate_sankey_links(applications, status_stages) -> tuple:
+    """Generate links for plotly to plot a Sankey Diagram
+    The links are kept as 3 parallel lists: sources, targets, values
     At this point, the data is still in human-readable format
 
-    Returns: DataFrame for Sankey Diagram
+    Returns: tuple of lists of sources, targets and values for each link
     """
 
-    # Make df for sankey graph
-    sankey_df = pd.DataFrame(columns=['source', 'target', 'value'])
+    # Parallel lists of links for sankey graph
+    sources, targets, values = [], [], []
 
     # Applications -> Source
-    application_sources = applications['Source'].value_counts()
-    for application_source in application_sources.index:
-        source = application_source
-        value = application_sources[application_source]
-        sankey_df = sankey_df._append({'source': 'Applications', 'target': source, 'value': value}, ignore_index=True)
+    application_sources = applications['Source'].value_counts(sort=False)
+    sources.extend(['Applications'] * len(application_sources))
+    targets.extend(application_sources.index)
+    values.extend(application_sources.tolist())
 
     # Source -> Status 1
-    application_statuses_1 = {}
-    for index, row in applications.iterrows():
-        if pd.notna(row['Status 1']):
-            status_update_1 = row['Source'], row['Status 1']
-            if status_update_1 in application_statuses_1:
-                application_statuses_1[status_update_1] += 1
-            else:
-                application_statuses_1[status_update_1] = 1
-        else:
-            no_update_status = row['Source'], 'No reply'
-            if no_update_status in application_statuses_1:
-                application_statuses_1[no_update_status] += 1
-            else:
-                application_statuses_1[no_update_status] = 1
-
-    for status_update_1 in application_statuses_1:
-        sankey_df = sankey_df._append({'source': status_update_1[0], 'target': status_update_1[1], 'value': application_statuses_1[status_update_1]}, ignore_index=True)
+    source_status_1 = applications[['Source', 'Status 1']].copy()
+    status_1 = source_status_1['Status 1']
+    if 'No reply' not in status_1.cat.categories:
+        status_1 = status_1.cat.add_categories('No reply')
+    source_status_1['Status 1'] = status_1.fillna('No reply')
+    application_statuses_1 = source_status_1.groupby(['Source', 'Status 1'], sort=False, dropna=False, observed=True).size()
+    sources.extend(application_statuses_1.index.get_level_values(0))
+    targets.extend(application_statuses_1.index.get_level_values(1))
+    values.extend(application_statuses_1.tolist())
 
     # Status 1 -> Status N
-    for i in range(len(status_stages)):
-        if i != 0:
-            application_statuses_i = {}
-            for index, row in applications.iterrows():
-                if pd.notna(row[status_stages[i]]):
-                    flow = row[status_stages[i-1]], row[status_stages[i]]
-                    if flow in application_statuses_i:
-                        application_statuses_i[flow] += 1
-                    else:
-                        application_statuses_i[flow] = 1
-            
-            for flow in application_statuses_i:
-                sankey_df = sankey_df._append({'source': flow[0], 'target': flow[1], 'value': application_statuses_i[flow]}, ignore_index=True)
-
-    return sankey_df
-
-def generate_color_references(unique_values_dict, sankey_df) -> dict:
+    for i in range(1, len(status_stages)):
+        flows = applications[[status_stages[i-1], status_stages[i]]].dropna(subset=[status_stages[i]])
+        application_statuses_i = flows.groupby(list(flows.columns), sort=False, dropna=False, observed=True).size()
+        sources.extend(application_statuses_i.index.get_level_values(0))
+        targets.extend(application_statuses_i.index.get_level_values(1))
+        values.extend(application_statuses_i.tolist())
+
+    return (sources, targets, values)
+
+def generate_color_references(unique_values_dict, target_codes) -> dict:
     """Generate color references for nodes and links
     - node_colors: list of colors for each node
     - link_colors: list of colors for each link
 
-    Link colors are based on the target node with reduced opacity
+    Link colors are based on the target node with reduced opacity,
+    looked up by the target codes from process_sankey_links
     
     Returns: dictionary of colors
     """
@@ -172,42 +153,31 @@ def generate_color_references(unique_values_dict, sankey_df) -> dict:
     node_red = 'rgba(249, 65, 68, 1)'
     node_green = 'rgba(67, 170, 139, 1)'
     node_black = 'rgba(0, 0, 0, 1)'
-    link_blue = node_blue.replace('1)', '0.5)')
-    link_yellow = node_yellow.replace('1)', '0.5)')
-    link_grey = node_grey.replace('1)', '0.5)')
-    link_red = node_red.replace('1)', '0.5)')
-    link_green = node_green.replace('1)', '0.5)')
-    link_black = node_black.replace('1)', '0.5)')
-
-    node_colors = ['rgba(39, 125, 161, 1)'] # Applications unaccounted for but should already be in list
+
+    # Assign each node its color once, then look colors up by node
+    job_sources = frozenset(job_sources)
+    rejected_statuses = frozenset({'Rejected', 'Rejected after Applying', 'Rejected after Interview'})
+    successful_statuses = frozenset({'Offered', 'Accepted', 'Declined'})
+
+    node_to_color = {'Applications': node_blue}
     for source_target in unique_nodes:
         if source_target in job_sources:
-            node_colors.append(node_blue) 
+            node_to_color[source_target] = node_blue
         elif source_target in intermediate_statuses:
-            node_colors.append(node_yellow)
+            node_to_color[source_target] = node_yellow
         elif source_target == 'No reply':
-            node_colors.append(node_grey)
-        elif source_target in ['Rejected', 'Rejected after Applying', 'Rejected after Interview']:
-            node_colors.append(node_red)
+            node_to_color[source_target] = node_grey
+        elif source_target in rejected_statuses:
+            node_to_color[source_target] = node_red
         elif source_target == 'DNF':
-            node_colors.append(node_black)
-        elif source_target in ['Offered', 'Accepted', 'Declined']:
-            node_colors.append(node_green) 
-
-    link_colors = []
-    for index, row in sankey_df.iterrows():
-        if row['target'] in job_sources:
-            link_colors.append(link_blue)
-        elif row['target'] in intermediate_statuses:
-            link_colors.append(link_yellow)
-        elif row['target'] == 'No reply':
-            link_colors.append(link_grey)
-        elif row['target'] in ['Rejected', 'Rejected after Applying', 'Rejected after Interview']:
-            link_colors.append(link_red)
-        elif row['target'] == 'DNF':
-            link_colors.append(link_black)
-        elif row['target'] in ['Offered', 'Accepted', 'Declined']:
-            link_colors.append(link_green)
+            node_to_color[source_target] = node_black
+        elif source_target in successful_statuses:
+            node_to_color[source_target] = node_green
+
+    # Unclassified nodes fall back to grey so colors stay aligned with node codes
+    node_colors = [node_to_color.get(node, node_grey) for node in unique_nodes]
+    link_palette = [color.replace('1)', '0.5)') for color in node_colors]
+    link_colors = [link_palette[target_code] for target_code in target_codes]
 
     colors_dict = {
         'node_colors': node_colors,
@@ -216,23 +186,21 @@ def generate_color_references(unique_values_dict, sankey_df) -> dict:
 
     return colors_dict
 
-def process_sankey_df(sankey_df, unique_values_dict) -> pd.DataFrame:
-    """Process the Sankey DataFrame to assign unique numbers to each source/target
+def process_sankey_links(sankey_links, unique_values_dict) -> tuple:
+    """Process the Sankey links to assign unique numbers to each source/target
     This is required for the Sankey Diagram to plot correctly
 
-    Returns: processed DataFrame, ready for plotting
+    Returns: tuple of lists of source codes, target codes and values, ready for plotting
     """
 
-    unique_nodes = unique_values_dict['unique_nodes']
-
-    # Assign unique number to each source/target
-    mapping_dict = {k: v for v, k in enumerate(unique_nodes)}
+    node_codes = unique_values_dict['node_codes']
+    sources, targets, values = sankey_links
 
     # Map the sources/targets to their unique number
-    sankey_df['source'] = sankey_df['source'].map(mapping_dict)
-    sankey_df['target'] = sankey_df['target'].map(mapping_dict)
+    source_codes = [node_codes[source] for source in sources]
+    target_codes = [node_codes[target] for target in targets]
 
-    return sankey_df
+    return (source_codes, target_codes, values)
 
 def position_nodes(unique_values_dict) -> tuple:
     """Assign positions for each node in the Sankey Diagram
@@ -266,12 +234,13 @@ def position_nodes(unique_values_dict) -> tuple:
 
     return (node_x_pos, node_y_pos)
 
-def plot_sankey(sankey_df, colors_dict, unique_values_dict, node_pos):
+def plot_sankey(sankey_links, colors_dict, unique_values_dict, node_pos):
     """Plot the Sankey Diagram using Plotly"""
 
     # Load unique values
     unique_nodes_with_values = unique_values_dict['unique_nodes_with_values']
     node_x_pos, node_y_pos = node_pos
+    source_codes, target_codes, values = sankey_links
 
     # Load colors
     node_colors = colors_dict['node_colors']
@@ -290,9 +259,9 @@ def plot_sankey(sankey_df, colors_dict, unique_values_dict, node_pos):
       y = node_y_pos
     ),
     link = dict(
-      source = sankey_df['source'].to_list(),
-      target = sankey_df['target'].to_list(),
-      value = sankey_df['value'].to_list(),
+      source = source_codes,
+      target = target_codes,
+      value = values,
       color = link_colors
   ))])
 
@@ -303,20 +272,22 @@ def plot_sankey(sankey_df, colors_dict, unique_values_dict, node_pos):
                       dict(x=0.5, y=1.04, showarrow=False, text=f"caa {datetime.today().date().strftime('%d %b %Y')}", xref="paper", yref="paper")
                       ],
                   width=1200, height=800)
-    fig.show()
 
-    # Export to png
-    fig.write_image(f"data/output/Internship Applications Sankey Diagram {datetime.today().date().strftime('%d%m%y')}.png")
+    # Export to png in the background while the interactive diagram is shown
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        export = executor.submit(fig.write_image, f"data/output/Internship Applications Sankey Diagram {datetime.today().date().strftime('%d%m%y')}.png")
+        fig.show()
+        export.result()
 
 def main():
     applications_raw = connect_to_gsheets()
     applications = clean_data(applications_raw)
     unique_values_dict, status_stages = get_unique_values(applications)
-    sankey_df = generate_sankey_df(applications, status_stages)
-    colors_dict = generate_color_references(unique_values_dict, sankey_df)
-    sankey_df = process_sankey_df(sankey_df, unique_values_dict)
+    sankey_links = generate_sankey_links(applications, status_stages)
+    sankey_links = process_sankey_links(sankey_links, unique_values_dict)
+    colors_dict = generate_color_references(unique_values_dict, sankey_links[1])
     node_pos = position_nodes(unique_values_dict)
-    plot_sankey(sankey_df, colors_dict, unique_values_dict, node_pos)
+    plot_sankey(sankey_links, colors_dict, unique_values_dict, node_pos)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file